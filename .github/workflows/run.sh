@@ -88,6 +88,9 @@ elif [[ "$1" == "lint" ]] ; then
               "$@"\
               include/
 
+elif [[ "$1" == "lint-test" ]] ; then
+    python3 -m unittest discover -s tests
+
 elif [[ "$1" == "build" ]] ; then
     shift 1
     build "build" "all" "$@"
@@ -100,6 +103,7 @@ Where command can be one of:
     coverage [build folder]         - build 'Debug', run test and report coverage
     collect-coverage [build folder] - collect coverage from previous build
     lint [build folder] [args]      - lint previous build, args passed to the lint.py as is
+    lint-test                       - run unit tests of lint.py
     docs                            - build HTML docs
     build [args]                    - build and pass args to cmake as is\n"
 fi
@@ -8,31 +8,51 @@ It runs over multiple files and directories in parallel.
 A diff output is produced and a sensible exit code is returned.
 """
 
-from __future__ import print_function, unicode_literals
-
 import argparse
-import codecs
+import asyncio
+import collections
 import difflib
 import fnmatch
+import functools
 import io
+import json
 import errno
 import multiprocessing
 import os
+import re
 import signal
 import subprocess
 import sys
+import tempfile
 import traceback
 import itertools
 
-from functools import partial
+from xml.etree import ElementTree
 
 try:
-    from subprocess import DEVNULL  # py3k
+    # C implementation of the difflib matcher, much faster on large files
+    from cdifflib import CSequenceMatcher
 except ImportError:
-    DEVNULL = open(os.devnull, "wb")
+    pass
+else:
+    # unified_diff() looks the matcher up in the difflib module
+    difflib.SequenceMatcher = CSequenceMatcher
 
 DEFAULT_EXTENSIONS = 'cc,cpp,cxx,c++,h,hh,hpp,hxx,h++,ipp,i'
 DEFAULT_LINT_IGNORE = '.clang-lint-ignore'
+DEFAULT_CLEAN_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                   'stream-client-lint', 'clean.json')
+CLANG_FORMAT_BATCH_SIZE = 32
+WRITE_CHUNK_SIZE = 65536
+HUNK_HEADER_RE = re.compile(r'@@ -(\d+)(,\d+|) \+(\d+)(,\d+|) @@$')
+
+# ANSI escape sequences for the colored output
+COLOR_RESET = '\x1b[0m'
+COLOR_BOLD = '\x1b[1m'
+COLOR_RED = '\x1b[31m'
+COLOR_GREEN = '\x1b[32m'
+COLOR_CYAN = '\x1b[36m'
+DIFF_LINE_COLORS = {'+': COLOR_GREEN, '-': COLOR_RED}
 
 # Use of utf-8 to decode the process output.
 #
@@ -50,11 +70,7 @@ DEFAULT_LINT_IGNORE = '.clang-lint-ignore'
 #   > Each translation completely replaces the format string
 #   > for the diagnostic.
 #   > -- http://clang.llvm.org/docs/InternalsManual.html#internals-diag-translation
-#
-# It's not pretty, due to Python 2 & 3 compatibility.
-ENCODING_PY3 = {}
-if sys.version_info[0] >= 3:
-    ENCODING_PY3['encoding'] = 'utf-8'
+ENCODING = 'utf-8'
 
 
 class ExitStatus:
@@ -64,57 +80,201 @@ class ExitStatus:
 
 
 def excludes_from_file(ignore_file):
-    excludes = []
     try:
         with io.open(ignore_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith('#'):
-                    # ignore comments
-                    continue
-                pattern = line.rstrip()
-                if not pattern:
-                    # allow empty lines
-                    continue
-                excludes.append(pattern)
+            lines = f.read().splitlines()
     except EnvironmentError as e:
         if e.errno != errno.ENOENT:
             raise
-    return excludes
-
-
-def list_files(files, recursive=False, extensions=None, exclude=None):
-    if extensions is None:
-        extensions = []
-    if exclude is None:
-        exclude = []
-
-    out = []
+        return []
+    # ignore comments and allow empty lines
+    return [pattern for pattern in (line.rstrip() for line in lines) if pattern and not pattern.startswith('#')]
+
+
+def compile_excludes(patterns):
+    # a single regex matching any of the glob-like patterns,
+    # instead of calling fnmatch() for each of them
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(os.path.normcase(p)) for p in patterns))
+
+
+def list_files(files,
+               recursive=False,
+               extensions=frozenset(),
+               exclude=None,
+               exclude_tidy=None,
+               skip_unformattable=False):
+    exclude_re = compile_excludes(exclude)
+    exclude_tidy_re = compile_excludes(exclude_tidy)
+    suffixes = tuple('.' + ext for ext in extensions if ext)
+    # an empty extension selects the files without one
+    no_extension = '' in extensions
+
+    def excluded(regex, path):
+        return regex is not None and regex.match(os.path.normcase(path)) is not None
+
+    clang_format_files = []
+    clang_tidy_files = []
     for file in files:
         if recursive and os.path.isdir(file):
-            for dirpath, dnames, fnames in os.walk(file):
-                fpaths = [os.path.join(dirpath, fname) for fname in fnames]
-                for pattern in exclude:
-                    # os.walk() supports trimming down the dnames list
-                    # by modifying it in-place,
-                    # to avoid unnecessary directory listings.
-                    dnames[:] = [x for x in dnames if not fnmatch.fnmatch(os.path.join(dirpath, x), pattern)]
-                    fpaths = [x for x in fpaths if not fnmatch.fnmatch(x, pattern)]
-                for f in fpaths:
-                    ext = os.path.splitext(f)[1][1:]
-                    if ext in extensions:
-                        out.append(f)
+            # directories left to scan, with whether they are excluded from clang-tidy analysis,
+            # those are still scanned for clang-format
+            pending = collections.deque([(file, False)])
+            while pending:
+                dirpath, tidy_excluded = pending.pop()
+                try:
+                    with os.scandir(dirpath) as entries:
+                        for entry in entries:
+                            # the entry type comes from the directory listing, no stat() is needed
+                            if entry.is_dir():
+                                # like os.walk(), don't follow symlinks to directories
+                                if not entry.is_symlink() and not excluded(exclude_re, entry.path):
+                                    tidy_excluded_dir = tidy_excluded or excluded(exclude_tidy_re, entry.path)
+                                    pending.append((entry.path, tidy_excluded_dir))
+                            elif ((entry.name.endswith(suffixes) or
+                                   (no_extension and not os.path.splitext(entry.name)[1][1:])) and
+                                  not excluded(exclude_re, entry.path)):
+                                if not skip_unformattable or needs_formatting(entry):
+                                    clang_format_files.append(entry.path)
+                                if not tidy_excluded and not excluded(exclude_tidy_re, entry.path):
+                                    clang_tidy_files.append(entry.path)
+                except OSError:
+                    # skip unreadable directories, as os.walk() does
+                    continue
         else:
-            out.append(file)
-    return out
+            clang_format_files.append(file)
+            clang_tidy_files.append(file)
+    return clang_format_files, clang_tidy_files
+
+
+def needs_formatting(entry):
+    # there is nothing to format in an empty file,
+    # symlinks found in the tree point to files formatted on their own or out of the tree
+    try:
+        return not entry.is_symlink() and entry.stat(follow_symlinks=False).st_size > 0
+    except OSError:
+        # let clang-format report the problem
+        return True
+
+
+def load_clean_cache(cache_file):
+    try:
+        with io.open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (EnvironmentError, ValueError):
+        # a missing or broken cache is just empty
+        return {}
+
+
+def save_clean_cache(cache_file, clean_cache):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_file), delete=False, encoding='utf-8') as f:
+            json.dump(clean_cache, f)
+        # replace at once, other runs may be reading the cache
+        os.replace(f.name, cache_file)
+    except EnvironmentError:
+        # the cache only saves time, linting went fine anyway
+        pass
 
 
-def make_diff(file, original, reformatted):
-    return list(
-        difflib.unified_diff(original,
-                             reformatted,
-                             fromfile='{}\t(original)'.format(file),
-                             tofile='{}\t(reformatted)'.format(file),
-                             n=3))
+@functools.lru_cache(maxsize=None)
+def style_file_state(path, inherit_dirpath):
+    # what the style from path depends on, including the style files it inherits from
+    st = os.stat(path)
+    state = '{}:{}:{}'.format(path, st.st_mtime_ns, st.st_size)
+    with io.open(path, 'rb') as f:
+        inherits = b'InheritParentConfig' in f.read()
+    if inherits and inherit_dirpath is not None:
+        state += '\n' + find_style_file(inherit_dirpath)
+    return state
+
+
+@functools.lru_cache(maxsize=None)
+def find_style_file(dirpath):
+    # the state of the style file clang-format would use for the files in dirpath
+    parent = os.path.dirname(dirpath)
+    for name in ('.clang-format', '_clang-format'):
+        path = os.path.join(dirpath, name)
+        if os.path.isfile(path):
+            return style_file_state(path, parent if parent != dirpath else None)
+    if parent == dirpath:
+        return ''
+    return find_style_file(parent)
+
+
+def file_state(file, fingerprint, style):
+    # what a clean result of a previous run is valid for
+    try:
+        st = os.stat(file)
+        dirpath = os.path.dirname(os.path.abspath(file))
+        if style and style.startswith('file:'):
+            # an explicit style file can still inherit from the ones next to the file
+            fingerprint += '\n' + style_file_state(os.path.abspath(style[len('file:'):]), dirpath)
+        elif not style or style == 'file' or 'InheritParentConfig' in style:
+            fingerprint += '\n' + find_style_file(dirpath)
+    except OSError:
+        # cannot tell, run clang-format on the file
+        return None
+    return [st.st_mtime_ns, st.st_size, fingerprint]
+
+
+def parse_replacements(replacements_xml):
+    # clang-format lists the replacements sorted by offset and not overlapping,
+    # offsets and lengths are in bytes of the original file
+    return [(int(r.get('offset')), int(r.get('length')), (r.text or '').encode('utf-8'))
+            for r in ElementTree.fromstring(replacements_xml).iter('replacement')]
+
+
+def split_replacements_documents(outs):
+    # clang-format outputs an xml document for each of the files, in order
+    return re.split(br'(?=<\?xml )', outs)[1:]
+
+
+def apply_replacements(original, replacements):
+    chunks = []
+    position = 0
+    for offset, length, text in replacements:
+        chunks.append(original[position:offset])
+        chunks.append(text)
+        position = offset + length
+    chunks.append(original[position:])
+    return b''.join(chunks)
+
+
+def shift_hunks(diff_lines, shift):
+    for line in diff_lines:
+        match = HUNK_HEADER_RE.match(line)
+        if match:
+            line = '@@ -{}{} +{}{} @@\n'.format(
+                int(match.group(1)) + shift,
+                match.group(2),
+                int(match.group(3)) + shift,
+                match.group(4),
+            )
+        yield line
+
+
+def make_diff(file, original, replacements, context=3):
+    reformatted = apply_replacements(original, replacements)
+    # lines before the first and after the last replacement are left as is,
+    # only diff the changed part of the file, with enough lines around for the context
+    first_offset = replacements[0][0]
+    last_offset = replacements[-1][0] + replacements[-1][1]
+    head = max(len(decode_lines(original[:first_offset])) - 1 - context, 0)
+    tail = max(len(decode_lines(original[last_offset:])) - 1 - context, 0)
+    original = decode_lines(original)
+    reformatted = decode_lines(reformatted)
+    diff_lines = difflib.unified_diff(original[head:len(original) - tail],
+                                      reformatted[head:len(reformatted) - tail],
+                                      fromfile='{}\t(original)'.format(file),
+                                      tofile='{}\t(reformatted)'.format(file),
+                                      n=context)
+    if head:
+        # hunk ranges are relative to the diffed part
+        diff_lines = shift_hunks(diff_lines, head)
+    return diff_lines
 
 
 class DiffError(Exception):
@@ -132,9 +292,9 @@ class UnexpectedError(Exception):
         self.exc = exc
 
 
-def wrap_exceptions(func, args, file):
+async def wrap_exceptions(func, args, file, *func_args):
     try:
-        ret = func(args, file)
+        ret = await func(args, file, *func_args)
         return ret
     except DiffError:
         raise
@@ -142,63 +302,104 @@ def wrap_exceptions(func, args, file):
         raise UnexpectedError('{}: {}: {}'.format(file, e.__class__.__name__, e), e)
 
 
-def run_clang_format_diff(args, file):
+def decode_lines(data):
+    # same newline handling as for the files read in text mode
+    return io.TextIOWrapper(io.BytesIO(data), encoding=ENCODING).readlines()
+
+
+async def run_process(invocation, stdout, stderr):
     try:
-        with io.open(file, 'r', encoding='utf-8') as f:
-            original = f.readlines()
-    except IOError as exc:
-        raise DiffError(str(exc))
+        proc = await asyncio.create_subprocess_exec(*invocation, stdout=stdout, stderr=stderr)
+    except OSError as exc:
+        raise DiffError("Command '{}' failed to start: {}".format(subprocess.list2cmdline(invocation), exc))
+    try:
+        # drain both pipes at once, so a full stderr cannot block the process
+        outs, errs = await proc.communicate()
+    except asyncio.CancelledError:
+        # do not leave the process behind when the run is aborted,
+        # and reap it even if the wait is cancelled again
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await asyncio.shield(proc.wait())
+        raise
+    return proc.returncode, outs, errs
 
+
+async def run_clang_format(args, files):
+    # a single clang-format process for several files amortizes its startup,
+    # returns a (replacements, errs, batch errs) or DiffError outcome for each of the files,
+    # or None if a batch of several files failed
     if args.in_place:
-        invocation = [args.clang_format_executable, '-i', file]
+        invocation = [args.clang_format_executable, '-i']
     else:
-        invocation = [args.clang_format_executable, file]
+        # only get the changes instead of the whole reformatted file
+        invocation = [args.clang_format_executable, '--output-replacements-xml']
 
     if args.style:
         invocation.extend(['--style', args.style])
+    invocation.extend(files)
 
-    print(" ".join(invocation))
+    print_invocation(invocation)
     if args.dry_run:
-        return [], []
+        return [(None, [], [])] * len(files)
+
+    returncode, outs, errs = await run_process(invocation,
+                                               stdout=asyncio.subprocess.PIPE,
+                                               stderr=asyncio.subprocess.PIPE)
+    errs = decode_lines(errs)
+    if returncode:
+        if len(files) > 1:
+            # the caller has to find out which of the files failed
+            return None
+        return [
+            DiffError(
+                "Command '{}' returned non-zero exit status {}".format(subprocess.list2cmdline(invocation),
+                                                                       returncode),
+                errs,
+            )
+        ]
 
-    try:
-        proc = subprocess.Popen(invocation,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                universal_newlines=True,
-                                **ENCODING_PY3)
-    except OSError as exc:
-        raise DiffError("Command '{}' failed to start: {}".format(subprocess.list2cmdline(invocation), exc))
-    proc_stdout = proc.stdout
-    proc_stderr = proc.stderr
-    if sys.version_info[0] < 3:
-        # make the pipes compatible with Python 3,
-        # reading lines should output unicode
-        encoding = 'utf-8'
-        proc_stdout = codecs.getreader(encoding)(proc_stdout)
-        proc_stderr = codecs.getreader(encoding)(proc_stderr)
-    # hopefully the stderr pipe won't get full and block the process
-    outs = list(proc_stdout.readlines())
-    errs = list(proc_stderr.readlines())
-    proc.wait()
-    if proc.returncode:
-        raise DiffError(
-            "Command '{}' returned non-zero exit status {}".format(subprocess.list2cmdline(invocation),
-                                                                   proc.returncode),
-            errs,
-        )
     if args.in_place:
+        documents = [None] * len(files)
+    else:
+        documents = split_replacements_documents(outs)
+        if len(documents) != len(files):
+            raise ValueError('expected {} replacements documents, got {}'.format(len(files), len(documents)))
+    # the diagnostics can not be told apart, report them with the first file
+    return [(document, errs if index == 0 else [], errs) for index, document in enumerate(documents)]
+
+
+async def run_clang_format_diff(args, file, batch, index, clean_cache=None, state=None):
+    outcome = (await batch)[index]
+    if isinstance(outcome, DiffError):
+        if clean_cache is not None:
+            clean_cache.pop(os.path.abspath(file), None)
+        raise outcome
+    replacements_xml, errs, batch_errs = outcome
+    if args.in_place or args.dry_run:
         return [], errs
-    return make_diff(file, original, outs), errs
-
-
-def run_clang_tidy(args, file):
+    replacements = parse_replacements(replacements_xml)
+    if clean_cache is not None:
+        # the diagnostics of a batch may be about any of its files
+        if replacements or batch_errs or state is None:
+            clean_cache.pop(os.path.abspath(file), None)
+        else:
+            clean_cache[os.path.abspath(file)] = state
+    if not replacements:
+        return [], errs
+    # the original is only needed to make a diff,
+    # read it only now to not hold all of the files at once
     try:
-        with io.open(file, 'r', encoding='utf-8') as f:
-            original = f.readlines()
+        with io.open(file, 'rb') as f:
+            original = f.read()
     except IOError as exc:
         raise DiffError(str(exc))
+    return make_diff(file, original, replacements), errs
+
 
+async def run_clang_tidy(args, file):
     invocation = [args.clang_tidy_executable, '--quiet', '-p', args.build_path]
     # if args.color == 'always':
     #     invocation.extend(['--use-color'])
@@ -208,69 +409,56 @@ def run_clang_tidy(args, file):
         invocation.extend(['--fix-errors'])
     invocation.extend([file])
 
-    print(" ".join(invocation))
+    print_invocation(invocation)
     if args.dry_run:
         return [], []
 
-    try:
-        proc = subprocess.Popen(invocation,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                universal_newlines=True,
-                                **ENCODING_PY3)
-    except OSError as exc:
-        raise DiffError("Command '{}' failed to start: {}".format(subprocess.list2cmdline(invocation), exc))
-    proc_stdout = proc.stdout
-    proc_stderr = proc.stderr
-    if sys.version_info[0] < 3:
-        # make the pipes compatible with Python 3,
-        # reading lines should output unicode
-        encoding = 'utf-8'
-        proc_stdout = codecs.getreader(encoding)(proc_stdout)
-        proc_stderr = codecs.getreader(encoding)(proc_stderr)
-    outs = list(proc_stdout.readlines())
-    errs = list(proc_stderr.readlines())
-    proc.wait()
-    if proc.returncode == 0:
-        return [], []
-    return outs, errs
+    # clang-tidy diagnostics may be huge, let the kernel buffer them in files
+    # instead of draining the pipes from python
+    with tempfile.TemporaryFile(mode='w+', encoding=ENCODING) as outs_file, \
+            tempfile.TemporaryFile(mode='w+', encoding=ENCODING) as errs_file:
+        returncode, _, _ = await run_process(invocation, stdout=outs_file, stderr=errs_file)
+        if returncode == 0:
+            return [], []
+        outs_file.seek(0)
+        errs_file.seek(0)
+        return outs_file.readlines(), errs_file.readlines()
 
 
-def bold_red(s):
-    return '\x1b[1m\x1b[31m' + s + '\x1b[0m'
+def print_invocation(invocation):
+    # one write for the whole line, through the same text stream as the diffs to keep their order
+    sys.stdout.write(' '.join(invocation) + '\n')
 
 
-def colorize(diff_lines):
-
-    def bold(s):
-        return '\x1b[1m' + s + '\x1b[0m'
-
-    def cyan(s):
-        return '\x1b[36m' + s + '\x1b[0m'
-
-    def green(s):
-        return '\x1b[32m' + s + '\x1b[0m'
+def bold_red(s):
+    return COLOR_BOLD + COLOR_RED + s + COLOR_RESET
 
-    def red(s):
-        return '\x1b[31m' + s + '\x1b[0m'
 
+def colorize(diff_lines):
     for line in diff_lines:
-        if line[:4] in ['--- ', '+++ ']:
-            yield bold(line)
+        if line.startswith(('--- ', '+++ ')):
+            yield COLOR_BOLD + line + COLOR_RESET
         elif line.startswith('@@ '):
-            yield cyan(line)
-        elif line.startswith('+'):
-            yield green(line)
-        elif line.startswith('-'):
-            yield red(line)
+            yield COLOR_CYAN + line + COLOR_RESET
         else:
-            yield line
+            color = DIFF_LINE_COLORS.get(line[:1])
+            yield color + line + COLOR_RESET if color else line
 
 
 def print_diff(diff_lines, use_color):
     if use_color:
         diff_lines = colorize(diff_lines)
-    sys.stdout.writelines(diff_lines)
+    # join the lines into large chunks instead of writing them one by one
+    chunk = []
+    chunk_size = 0
+    for line in diff_lines:
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= WRITE_CHUNK_SIZE:
+            sys.stdout.write(''.join(chunk))
+            chunk = []
+            chunk_size = 0
+    sys.stdout.write(''.join(chunk))
 
 
 def print_trouble(prog, message, use_colors):
@@ -280,6 +468,82 @@ def print_trouble(prog, message, use_colors):
     print("{}: {} {}".format(prog, error_text, message), file=sys.stderr)
 
 
+async def lint_files(args, prog, clang_format_files, clang_tidy_files, clean_cache, states, colored_stdout,
+                     colored_stderr):
+    # the processes are waited for from a single thread,
+    # only limit their number to not overload the machine
+    jobs = multiprocessing.cpu_count()
+    semaphore = asyncio.Semaphore(jobs * 2)
+
+    async def limited(func, *func_args):
+        # only make the coroutine once there is a slot, a cancelled wait leaves nothing unawaited
+        async with semaphore:
+            return await func(*func_args)
+
+    async def run_batch(files):
+        outcomes = await limited(run_clang_format, args, files)
+        if outcomes is None:
+            # run the files of a failed batch on their own, to report the right ones
+            outcomes = await asyncio.gather(*(limited(run_clang_format, args, [file]) for file in files))
+            outcomes = [file_outcomes[0] for file_outcomes in outcomes]
+        return outcomes
+
+    async def run_tidy(file, batch):
+        if batch is not None:
+            # clang-tidy --fix-errors rewrites the file too, let clang-format be done with it first
+            await asyncio.wait([batch])
+        return await limited(wrap_exceptions, run_clang_tidy, args, file)
+
+    # keep the batches small enough to still use all of the cpus
+    batch_size = max(min(CLANG_FORMAT_BATCH_SIZE, -(-len(clang_format_files) // jobs)), 1)
+    batches = []
+    # the format batch of each of the files, when both tools edit them in place
+    file_batches = {}
+    tasks = []
+    for start in range(0, len(clang_format_files), batch_size):
+        files = clang_format_files[start:start + batch_size]
+        batch = asyncio.ensure_future(run_batch(files))
+        batches.append(batch)
+        if args.in_place:
+            file_batches.update((file, batch) for file in files)
+        tasks.extend(
+            asyncio.ensure_future(
+                wrap_exceptions(run_clang_format_diff, args, file, batch, index, clean_cache, states.get(file)))
+            for index, file in enumerate(files))
+    tasks.extend(asyncio.ensure_future(run_tidy(file, file_batches.get(file))) for file in clang_tidy_files)
+
+    retcode = ExitStatus.SUCCESS
+    for result in asyncio.as_completed(tasks):
+        try:
+            outs, errs = await result
+        except DiffError as e:
+            print_trouble(prog, str(e), use_colors=colored_stderr)
+            retcode = ExitStatus.TROUBLE
+            sys.stderr.writelines(e.errs)
+        except UnexpectedError as e:
+            print_trouble(prog, str(e), use_colors=colored_stderr)
+            sys.stderr.write(e.formatted_traceback)
+            retcode = ExitStatus.TROUBLE
+            # stop at the first unexpected error,
+            # something could be very wrong,
+            # don't process all files unnecessarily
+            for task in itertools.chain(batches, tasks):
+                task.cancel()
+            await asyncio.gather(*batches, *tasks, return_exceptions=True)
+            break
+        else:
+            sys.stderr.writelines(errs)
+            # diffs are generated lazily, look at the first line to tell if there is any
+            outs = iter(outs)
+            first_line = next(outs, None)
+            if first_line is not None:
+                # results come in any order, do not hide an earlier trouble
+                retcode = max(retcode, ExitStatus.DIFF)
+                if not args.quiet:
+                    print_diff(itertools.chain([first_line], outs), use_color=colored_stdout)
+    return retcode
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--clang-format-executable',
@@ -318,6 +582,10 @@ def main():
                         ' from clang-tidy analysis')
     parser.add_argument('--style', help='formatting style to apply (LLVM, Google, Chromium, Mozilla, WebKit)')
     parser.add_argument('-p', '--build-path', help='build path', default='./build')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='skip the files found clean by a previous run with the same clang-format and style'
+                        ' (cached in {})'.format(DEFAULT_CLEAN_CACHE))
 
     args = parser.parse_args()
 
@@ -341,68 +609,64 @@ def main():
         colored_stdout = sys.stdout.isatty()
         colored_stderr = sys.stderr.isatty()
 
-    for invocation in [[args.clang_format_executable, str("--version")],
-                       [args.clang_tidy_executable, str("--version")]]:
+    # start both probes at once and only then wait for them
+    probes = []
+    for invocation in [[args.clang_format_executable, "--version"],
+                       [args.clang_tidy_executable, "--version"]]:
         try:
-            subprocess.check_call(invocation, stdout=DEVNULL)
-        except subprocess.CalledProcessError as e:
-            print_trouble(parser.prog, str(e), use_colors=colored_stderr)
-            return ExitStatus.TROUBLE
+            probes.append((invocation, subprocess.Popen(invocation, stdout=subprocess.PIPE)))
         except OSError as e:
             print_trouble(
                 parser.prog,
                 "Command '{}' failed to start: {}".format(subprocess.list2cmdline(invocation), e),
                 use_colors=colored_stderr,
             )
+            # do not leave the probes already started behind
+            for _, proc in probes:
+                proc.kill()
+                proc.communicate()
+            return ExitStatus.TROUBLE
+    # wait for all of the probes before giving up on a failed one
+    versions = [proc.communicate()[0] for _, proc in probes]
+    for invocation, proc in probes:
+        if proc.returncode:
+            print_trouble(parser.prog,
+                          str(subprocess.CalledProcessError(proc.returncode, invocation)),
+                          use_colors=colored_stderr)
             return ExitStatus.TROUBLE
 
-    retcode = ExitStatus.SUCCESS
-
+    # accept '.cpp, h' as well, an empty entry selects the files without an extension
+    extensions = frozenset(ext.strip().lstrip('.') for ext in args.extensions.split(','))
     excludes = excludes_from_file(DEFAULT_LINT_IGNORE)
     excludes.extend(args.exclude)
-    clang_format_files = list_files(args.files,
-                                    recursive=args.recursive,
-                                    exclude=excludes,
-                                    extensions=args.extensions.split(','))
-
-    clang_tidy_excludes = excludes
-    clang_tidy_excludes.extend(args.exclude_tidy)
-    clang_tidy_files = list_files(args.files,
-                                  recursive=args.recursive,
-                                  exclude=clang_tidy_excludes,
-                                  extensions=args.extensions.split(','))
+    clang_format_files, clang_tidy_files = list_files(args.files,
+                                                      recursive=args.recursive,
+                                                      exclude=excludes,
+                                                      exclude_tidy=args.exclude_tidy,
+                                                      extensions=extensions,
+                                                      skip_unformattable=not args.dry_run)
 
     if not clang_format_files and not clang_tidy_files:
         return
 
-    # execute directly instead of in a pool,
-    # less overhead, simpler stacktraces
-    it = itertools.chain((wrap_exceptions(run_clang_format_diff, args, file) for file in clang_format_files),
-                         (wrap_exceptions(run_clang_tidy, args, file) for file in clang_tidy_files))
-
-    while True:
-        try:
-            outs, errs = next(it)
-        except StopIteration:
-            break
-        except DiffError as e:
-            print_trouble(parser.prog, str(e), use_colors=colored_stderr)
-            retcode = ExitStatus.TROUBLE
-            sys.stderr.writelines(e.errs)
-        except UnexpectedError as e:
-            print_trouble(parser.prog, str(e), use_colors=colored_stderr)
-            sys.stderr.write(e.formatted_traceback)
-            retcode = ExitStatus.TROUBLE
-            # stop at the first unexpected error,
-            # something could be very wrong,
-            # don't process all files unnecessarily
-            break
-        else:
-            sys.stderr.writelines(errs)
-            if outs:
-                retcode = ExitStatus.DIFF
-                if not args.quiet:
-                    print_diff(outs, use_color=colored_stdout)
+    clean_cache = None
+    states = {}
+    if args.cache and not args.in_place and not args.dry_run:
+        clean_cache = load_clean_cache(DEFAULT_CLEAN_CACHE)
+        # skip the files found clean by a previous run, unless they or the formatting setup changed,
+        # the state is taken before clang-format reads the file
+        fingerprint = '{}\n{}'.format(versions[0].decode(ENCODING, 'replace').strip(), args.style or '')
+        states = {file: file_state(file, fingerprint, args.style) for file in clang_format_files}
+        clang_format_files = [
+            file for file in clang_format_files
+            if states[file] is None or clean_cache.get(os.path.abspath(file)) != states[file]
+        ]
+
+    retcode = asyncio.run(
+        lint_files(args, parser.prog, clang_format_files, clang_tidy_files, clean_cache, states, colored_stdout,
+                   colored_stderr))
+    if clean_cache is not None:
+        save_clean_cache(DEFAULT_CLEAN_CACHE, clean_cache)
     return retcode
 
 
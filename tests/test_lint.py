@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Unit tests for lint.py, the tools it runs are replaced by python stubs.
+
+Run from the repository root with: python3 -m unittest discover -s tests
+"""
+
+import difflib
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+LINT_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lint.py')
+spec = importlib.util.spec_from_file_location('lint', LINT_PY)
+lint = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(lint)
+
+
+# stands for clang-format, supports -i and --output-replacements-xml,
+# two leading spaces of a file are replaced
+STUB_CLANG_FORMAT = r'''
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+if args == ['--version']:
+    print(os.environ.get('STUB_VERSION', 'clang-format version 1.0.0'))
+    sys.exit(0)
+if '--style' in args:
+    del args[args.index('--style'):args.index('--style') + 2]
+files = [arg for arg in args if not arg.startswith('-')]
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.writelines(os.path.abspath(file) + '\n' for file in files)
+if os.environ.get('STUB_FORMAT_ERRS'):
+    sys.stderr.write('warning: stub diagnostic\n')
+for file in files:
+    with open(file, 'rb') as f:
+        data = f.read()
+    if '-i' in args:
+        time.sleep(float(os.environ.get('STUB_FORMAT_DELAY', '0')))
+        with open(file, 'wb') as f:
+            f.write(data + b'// formatted\n')
+        continue
+    sys.stdout.write("<?xml version='1.0'?>\n<replacements xml:space='preserve' incomplete_format='false'>\n")
+    if os.environ.get('STUB_MALFORMED'):
+        continue
+    if data.startswith(b'  '):
+        sys.stdout.write("<replacement offset='0' length='2'></replacement>\n")
+    sys.stdout.write('</replacements>\n')
+'''
+
+# stands for clang-tidy, --fix-errors appends a line to the file
+STUB_CLANG_TIDY = r'''
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+if args == ['--version']:
+    print('clang-tidy version 1.0.0')
+    sys.exit(0)
+file = args[-1]
+with open(file, 'rb') as f:
+    data = f.read()
+time.sleep(float(os.environ.get('STUB_TIDY_DELAY', '0')))
+if '--fix-errors' in args:
+    with open(file, 'wb') as f:
+        f.write(data + b'// tidied\n')
+'''
+
+
+class ListFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        for path in ['a.cpp', 'b.h', 'c.txt', 'Makefile', 'empty.cpp', 'sub/d.cpp', 'gen/e.cpp', 'gen/deep/f.cpp',
+                     'skip/g.cpp', 'sub/skip/h.cpp']:
+            path = self.path(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'' if path.endswith('empty.cpp') else b'int a;\n')
+        os.symlink('a.cpp', self.path('link.cpp'))
+        os.symlink('sub', self.path('linkdir'))
+
+    def path(self, path):
+        return os.path.join(self.tmpdir, path)
+
+    def list_files(self, files, **kwargs):
+        kwargs.setdefault('extensions', frozenset(['cpp', 'h']))
+        # the order of the scan is not specified
+        return tuple(sorted(os.path.relpath(path, self.tmpdir) for path in paths)
+                     for paths in lint.list_files([self.path(file) for file in files], **kwargs))
+
+    def test_recursive(self):
+        files = ['a.cpp', 'b.h', 'empty.cpp', 'gen/deep/f.cpp', 'gen/e.cpp', 'link.cpp', 'skip/g.cpp', 'sub/d.cpp',
+                 'sub/skip/h.cpp']
+        # symlinks to directories are not followed
+        self.assertEqual(self.list_files(['.'], recursive=True), (files, files))
+
+    def test_unformattable(self):
+        clang_format_files, clang_tidy_files = self.list_files(['.'], recursive=True, skip_unformattable=True)
+        self.assertNotIn('empty.cpp', clang_format_files)
+        self.assertNotIn('link.cpp', clang_format_files)
+        self.assertIn('empty.cpp', clang_tidy_files)
+        self.assertIn('link.cpp', clang_tidy_files)
+
+    def test_explicit_files(self):
+        files = ['c.txt', 'empty.cpp', 'link.cpp', 'sub']
+        self.assertEqual(self.list_files(files, recursive=True, skip_unformattable=True, exclude=['*.txt']),
+                         (['c.txt', 'empty.cpp', 'link.cpp', 'sub/d.cpp', 'sub/skip/h.cpp'],
+                          ['c.txt', 'empty.cpp', 'link.cpp', 'sub/d.cpp', 'sub/skip/h.cpp']))
+        # directories are only scanned recursively
+        self.assertEqual(self.list_files(['sub']), (['sub'], ['sub']))
+
+    def test_exclude(self):
+        files = ['a.cpp', 'empty.cpp', 'gen/deep/f.cpp', 'gen/e.cpp', 'link.cpp', 'sub/d.cpp']
+        self.assertEqual(self.list_files(['.'], recursive=True, exclude=['*/skip', '*.h']), (files, files))
+
+    def test_exclude_tidy(self):
+        files = ['a.cpp', 'b.h', 'empty.cpp', 'gen/deep/f.cpp', 'gen/e.cpp', 'link.cpp', 'sub/d.cpp']
+        # the excluded directories are still scanned for clang-format, including their subdirectories
+        self.assertEqual(self.list_files(['.'], recursive=True, exclude=['*/skip'], exclude_tidy=['*/gen', '*.h']),
+                         (files, ['a.cpp', 'empty.cpp', 'link.cpp', 'sub/d.cpp']))
+
+    def test_no_extension(self):
+        clang_format_files, _ = self.list_files(['.'], recursive=True, extensions=frozenset(['h', '']))
+        self.assertEqual(clang_format_files, ['Makefile', 'b.h'])
+
+
+class StubToolsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(self.bindir)
+        for name, source in (('clang-format', STUB_CLANG_FORMAT), ('clang-tidy', STUB_CLANG_TIDY)):
+            with open(os.path.join(self.bindir, name), 'w') as f:
+                f.write('#!{}\n{}'.format(sys.executable, source))
+            os.chmod(os.path.join(self.bindir, name), 0o755)
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.src = os.path.join(self.tmpdir, 'src')
+        os.mkdir(self.src)
+
+    def write(self, path, data):
+        path = os.path.join(self.tmpdir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(os.path.join(self.tmpdir, path), 'rb') as f:
+            return f.read()
+
+    def run_lint(self, *args, **env):
+        # returns the completed process and the files clang-format got
+        if os.path.exists(self.log):
+            os.remove(self.log)
+        environ = dict(os.environ, STUB_LOG=self.log, XDG_CACHE_HOME=os.path.join(self.tmpdir, 'cache'))
+        environ.update(env)
+        proc = subprocess.run([
+            sys.executable, LINT_PY,
+            '--clang-format-executable', os.path.join(self.bindir, 'clang-format'),
+            '--clang-tidy-executable', os.path.join(self.bindir, 'clang-tidy')
+        ] + list(args),
+                              cwd=self.tmpdir,
+                              env=environ,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True)
+        formatted = []
+        if os.path.exists(self.log):
+            with open(self.log) as f:
+                formatted = f.read().splitlines()
+        return proc, formatted
+
+
+def full_diff(file, original, reformatted):
+    return list(difflib.unified_diff(lint.decode_lines(original),
+                                     lint.decode_lines(reformatted),
+                                     fromfile='{}\t(original)'.format(file),
+                                     tofile='{}\t(reformatted)'.format(file)))
+
+
+def replacements_xml(replacements):
+    return ''.join(['<?xml version=\'1.0\'?>\n<replacements xml:space=\'preserve\' incomplete_format=\'false\'>\n']
+                   + ["<replacement offset='{}' length='{}'>{}</replacement>\n".format(*r) for r in replacements]
+                   + ['</replacements>\n']).encode('utf-8')
+
+
+class ApplyReplacementsTest(unittest.TestCase):
+
+    def test_no_replacements(self):
+        self.assertEqual(lint.apply_replacements(b'int a;\n', []), b'int a;\n')
+
+    def test_offset_zero(self):
+        self.assertEqual(lint.apply_replacements(b'  int a;\n', [(0, 2, b'')]), b'int a;\n')
+        self.assertEqual(lint.apply_replacements(b'int a;\n', [(0, 0, b'// x\n')]), b'// x\nint a;\n')
+
+    def test_no_trailing_newline(self):
+        self.assertEqual(lint.apply_replacements(b'int a;   ', [(6, 3, b'')]), b'int a;')
+        self.assertEqual(lint.apply_replacements(b'int a;', [(6, 0, b'\n')]), b'int a;\n')
+
+    def test_crlf(self):
+        original = b'int a;  \r\nint b;\r\n'
+        self.assertEqual(lint.apply_replacements(original, [(6, 2, b'')]), b'int a;\r\nint b;\r\n')
+
+    def test_multiple(self):
+        original = b'int  a;\nint  b;\nint  c;\n'
+        replacements = [(3, 2, b' '), (19, 2, b' ')]
+        self.assertEqual(lint.apply_replacements(original, replacements), b'int a;\nint  b;\nint c;\n')
+
+
+class ShiftHunksTest(unittest.TestCase):
+
+    def test_shift(self):
+        lines = ['--- a\t(original)\n', '+++ a\t(reformatted)\n', '@@ -1,7 +1,6 @@\n', ' x\n',
+                 '@@ -3 +3,0 @@\n', '-@@ -1,2 +1,2 @@\n']
+        self.assertEqual(list(lint.shift_hunks(lines, 10)),
+                         ['--- a\t(original)\n', '+++ a\t(reformatted)\n', '@@ -11,7 +11,6 @@\n', ' x\n',
+                          '@@ -13 +13,0 @@\n', '-@@ -1,2 +1,2 @@\n'])
+
+
+class MakeDiffTest(unittest.TestCase):
+
+    def check(self, original, replacements):
+        reformatted = lint.apply_replacements(original, replacements)
+        self.assertEqual(list(lint.make_diff('a.cpp', original, replacements)),
+                         full_diff('a.cpp', original, reformatted))
+
+    def test_start_of_file(self):
+        lines = [b'int a%d;\n' % i for i in range(20)]
+        self.check(b'  ' + b''.join(lines), [(0, 2, b'')])
+
+    def test_middle_of_file(self):
+        original = b''.join(b'int a%d;\n' % i for i in range(40))
+        offset = original.index(b'a20;')
+        self.check(original, [(offset - 1, 1, b'  ')])
+
+    def test_end_of_file_without_trailing_newline(self):
+        original = b''.join(b'int a%d;\n' % i for i in range(20)) + b'int b;   '
+        self.check(original, [(len(original) - 3, 3, b'')])
+        self.check(original, [(len(original), 0, b'\n')])
+
+    def test_crlf(self):
+        original = b''.join(b'int a%d;\r\n' % i for i in range(20))
+        offset = original.index(b'a10;')
+        self.check(original, [(offset - 1, 1, b'\r\n')])
+
+    def test_several_hunks(self):
+        original = b''.join(b'int a%d;\n' % i for i in range(60))
+        self.check(original, [(original.index(b'a5;') - 1, 1, b'  '),
+                              (original.index(b'a50;') - 1, 1, b'\n')])
+
+    def test_line_splitting(self):
+        original = b''.join(b'int a%d;\n' % i for i in range(30))
+        offset = original.index(b'a15;')
+        self.check(original, [(offset - 4, 0, b'\n'), (offset + 4, 1, b'\n\n')])
+
+
+class ParseReplacementsTest(unittest.TestCase):
+
+    def test_parse(self):
+        document = replacements_xml([(0, 2, ''), (9, 1, '&lt;?xml '), (12, 0, '\n')])
+        self.assertEqual(lint.parse_replacements(document), [(0, 2, b''), (9, 1, b'<?xml '), (12, 0, b'\n')])
+
+    def test_clean(self):
+        self.assertEqual(lint.parse_replacements(replacements_xml([])), [])
+
+
+class SplitReplacementsDocumentsTest(unittest.TestCase):
+
+    def test_batch(self):
+        documents = [replacements_xml([]),
+                     replacements_xml([(0, 2, ''), (9, 1, '&lt;?xml ')]),
+                     replacements_xml([(4, 0, '\n')])]
+        split = lint.split_replacements_documents(b''.join(documents))
+        self.assertEqual(split, documents)
+        self.assertEqual([lint.parse_replacements(document) for document in split],
+                         [[], [(0, 2, b''), (9, 1, b'<?xml ')], [(4, 0, b'\n')]])
+
+    def test_empty_output(self):
+        self.assertEqual(lint.split_replacements_documents(b''), [])
+
+
+class VersionProbeTest(StubToolsTestCase):
+
+    def test_missing_clang_tidy(self):
+        self.write('src/a.cpp', b'int a;\n')
+        missing = os.path.join(self.bindir, 'missing-clang-tidy')
+        # the clang-format probe is already running, it must not be left behind
+        proc, _ = self.run_lint('--clang-tidy-executable', missing, 'src/a.cpp', PYTHONWARNINGS='always')
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn("Command '{} --version' failed to start".format(missing), proc.stderr)
+        self.assertNotIn('ResourceWarning', proc.stderr)
+
+
+class InPlaceTest(StubToolsTestCase):
+
+    def test_format_and_tidy_edits_are_kept(self):
+        files = ['src/{}.cpp'.format(name) for name in 'abc']
+        for file in files:
+            self.write(file, b'int a;\n')
+        proc, _ = self.run_lint('-r', '-i', 'src', STUB_FORMAT_DELAY='0.3', STUB_TIDY_DELAY='0.3')
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        for file in files:
+            # clang-tidy runs on the formatted file
+            self.assertEqual(self.read(file), b'int a;\n// formatted\n// tidied\n')
+
+
+class CleanCacheTest(StubToolsTestCase):
+
+    def setUp(self):
+        super(CleanCacheTest, self).setUp()
+        self.file = self.write('src/a.cpp', b'int a;\n')
+
+    def lint(self, *args, **env):
+        # tells if clang-format was run on the file
+        proc, formatted = self.run_lint('--cache', *(args + (self.file,)), **env)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return self.file in formatted
+
+    def touch(self, path):
+        path = os.path.join(self.tmpdir, path)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def test_clean_file_is_skipped(self):
+        self.assertTrue(self.lint())
+        self.assertFalse(self.lint())
+
+    def test_no_cache_without_option(self):
+        self.run_lint(self.file)
+        _, formatted = self.run_lint(self.file)
+        self.assertEqual(formatted, [self.file])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'cache')))
+
+    def test_file_mtime(self):
+        self.assertTrue(self.lint())
+        self.touch(self.file)
+        self.assertTrue(self.lint())
+        self.assertFalse(self.lint())
+
+    def test_file_size(self):
+        self.assertTrue(self.lint())
+        st = os.stat(self.file)
+        self.write(self.file, b'int ab;\n')
+        os.utime(self.file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertTrue(self.lint())
+
+    def test_style_file_in_directory(self):
+        self.assertTrue(self.lint())
+        self.write('src/.clang-format', b'BasedOnStyle: LLVM\n')
+        self.assertTrue(self.lint())
+        self.assertFalse(self.lint())
+        self.touch('src/.clang-format')
+        self.assertTrue(self.lint())
+
+    def test_inherited_style_file(self):
+        self.write('.clang-format', b'BasedOnStyle: LLVM\n')
+        self.write('src/.clang-format', b'InheritParentConfig: true\n')
+        self.assertTrue(self.lint())
+        self.assertFalse(self.lint())
+        self.touch('.clang-format')
+        self.assertTrue(self.lint())
+
+    def test_not_inherited_style_file(self):
+        self.write('.clang-format', b'BasedOnStyle: LLVM\n')
+        self.write('src/.clang-format', b'BasedOnStyle: Google\n')
+        self.assertTrue(self.lint())
+        self.touch('.clang-format')
+        self.assertFalse(self.lint())
+
+    def test_explicit_style_file(self):
+        style = self.write('styles/custom.yml', b'BasedOnStyle: LLVM\n')
+        self.assertTrue(self.lint('--style=file:' + style))
+        self.assertFalse(self.lint('--style=file:' + style))
+        self.touch(style)
+        self.assertTrue(self.lint('--style=file:' + style))
+
+    def test_clang_format_version(self):
+        self.assertTrue(self.lint())
+        self.assertTrue(self.lint(STUB_VERSION='clang-format version 2.0.0'))
+        self.assertFalse(self.lint(STUB_VERSION='clang-format version 2.0.0'))
+
+    def test_batch_with_diagnostics(self):
+        # the diagnostics may be about the file, it is not clean
+        self.assertTrue(self.lint(STUB_FORMAT_ERRS='1'))
+        self.assertTrue(self.lint())
+        self.assertFalse(self.lint())
+
+    def test_dirty_file(self):
+        self.assertTrue(self.lint())
+        st = os.stat(self.file)
+        self.write(self.file, b'  int a;\n')
+        proc, formatted = self.run_lint('--cache', self.file)
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn('-  int a;\n+int a;\n', proc.stdout)
+        # even if it is reverted to an identical state
+        self.write(self.file, b'int a;\n')
+        os.utime(self.file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertTrue(self.lint())
+
+
+class UnexpectedErrorTest(StubToolsTestCase):
+
+    def test_abort_on_malformed_replacements(self):
+        # more runs than slots, some of them are cancelled before they start
+        for index in range(os.cpu_count() * 4):
+            self.write('src/{}.cpp'.format(index), b'int a;\n')
+        proc, _ = self.run_lint('-r', 'src', STUB_MALFORMED='1', STUB_TIDY_DELAY='0.2')
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn('ParseError', proc.stderr)
+        self.assertNotIn('never awaited', proc.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()